@@ -1,11 +1,15 @@
 import os
 import re
 import sys
-import json
+import atexit
+import select
 import yaml
+import asyncio
+import orjson
 import logging
 import tornado.gen
 import tornado.ioloop
+import tornado.iostream
 import tornado.websocket
 import tornado.httpclient
 from tornado.escape import url_escape, url_unescape
@@ -19,17 +23,19 @@ import cv2
 import dbus
 import time
 import psutil
-import plocate
 import pulsectl
 import datetime
+import threading
 import subprocess
 from xdo import Xdo
-from plocate import plocate
 
 import gi
 gi.require_version('Tracker', '2.0')
 from gi.repository import Tracker
 
+# Sink flag from PulseAudio's def.h, not exported by pulsectl
+PA_SINK_HARDWARE = 0x0004
+
 class WSClient:
     def __init__(self, url, ping_interval=60, ping_timeout=60*3, max_workers=4):
         self.url = url
@@ -37,14 +43,82 @@ class WSClient:
         self.ping_timeout = ping_timeout
         self.ioloop = tornado.ioloop.IOLoop.instance()
         self.ws = None
+        self.retries = 0 # failed connection attempts in a row
         self.connect()
         self.executor = ThreadPoolExecutor(max_workers=max_workers)
 
         # Keep track of which files have been found, so you can fetch them
         self.locateResults = {}
 
-        # Keep connecting if it dies, every minute
-        tornado.ioloop.PeriodicCallback(self.keep_alive, 60000, io_loop=self.ioloop).start()
+        # Where to save pictures, screenshots, and fetched files
+        self.dropbox = os.path.join(os.environ["HOME"], "Dropbox")
+
+        # Lowercase names of running processes and when they were last read
+        self.procNames = (0.0, frozenset())
+
+        # Disk partitions, reread when the mount table changes
+        self.partitions = None
+        self.partitionsLock = threading.Lock()
+        self.mounts = open("/proc/self/mounts")
+        self.mountsPoll = select.poll()
+        self.mountsPoll.register(self.mounts, select.POLLPRI)
+
+        # Battery status and when it was last read
+        self.battery = (0.0, None)
+
+        # Sample CPU usage every second in the background, since measuring it
+        # when queried would block for the measurement interval
+        psutil.cpu_percent(interval=None)
+        self.cpuPercent = 0.0
+        tornado.ioloop.PeriodicCallback(self.sample_cpu, 1000, io_loop=self.ioloop).start()
+
+        # Webcam, opened when first taking a picture and then reused
+        self.cap = None
+        self.capLock = threading.Lock()
+        atexit.register(self.release_camera)
+
+        # PulseAudio connection, opened when first setting the volume and then
+        # reused
+        self.pulse = None
+        self.pulseLock = threading.Lock()
+
+        # DBus methods for power off, lock, etc.
+        self.connect_dbus()
+
+        # Which power commands are allowed, rarely changes so check every 10
+        # minutes rather than on every command
+        self.caps = {}
+        self.check_caps()
+        tornado.ioloop.PeriodicCallback(lambda: self.executor.submit(self.check_caps),
+                10*60000, io_loop=self.ioloop).start()
+
+        # Handlers for each query and command from the server
+        self.queries = {
+            "memory": self.query_memory,
+            "disk": self.query_disk,
+            "battery": self.query_battery,
+            "processor": self.query_processor,
+            "open": self.query_open,
+        }
+        self.commands = {
+            "power off": self.command_poweroff,
+            "sleep": self.command_sleep,
+            "reboot": self.command_reboot,
+            "lock": self.command_lock,
+            "unlock": self.command_unlock,
+            "open": self.command_open,
+            "close": self.command_notImplemented,
+            "kill": self.command_notImplemented,
+            "locate": self.command_locate,
+            "fetch": self.command_fetch,
+            "set volume": self.command_setVolume,
+            "stop": self.command_notImplemented,
+            "take a picture": self.command_picture,
+            "screenshot": self.command_screenshot,
+            "download": self.command_notImplemented,
+            "start recording": self.command_notImplemented,
+            "stop recording": self.command_notImplemented,
+        }
 
         self.ioloop.start()
 
@@ -56,245 +130,359 @@ class WSClient:
                     ping_timeout=self.ping_timeout)
         except tornado.httpclient.HTTPError:
             logging.error("HTTP error - could not connect to websocket")
+            self.reconnect()
+        except (OSError, tornado.iostream.StreamClosedError):
+            logging.error("Could not connect to websocket")
+            self.reconnect()
         else:
             logging.info("Connection opened")
+            self.retries = 0
             self.run()
 
+    def reconnect(self):
+        """
+        Connect again after a delay, doubling it after each failed attempt up
+        to a minute
+        """
+        delay = min(60, 2**self.retries)
+        self.retries += 1
+        logging.info("Reconnecting in "+str(delay)+" seconds")
+        self.ioloop.call_later(delay, self.connect)
+
     @tornado.gen.coroutine
     def run(self):
+        # Bound once per connection rather than looked up for every message
+        read = self.ws.read_message
+        write = self.ws.write_message
+        loads = orjson.loads
+        dumps = orjson.dumps
+
         try:
             while True:
                 result = None
                 longResult = None
 
-                msg = yield self.ws.read_message()
+                msg = yield read()
 
                 # If closed, break; otherwise, load message JSON data
                 if msg is None:
                     logging.info("Connection closed")
                     self.ws = None
+                    self.reconnect()
                     break
                 else:
-                    msg = json.loads(msg)
+                    msg = loads(msg)
 
                 # Process message
                 if "error" in msg:
                     logging.error(msg["error"])
                     break
                 elif "query" in msg:
-                    value = msg["query"]["value"]
-                    x = msg["query"]["x"]
-                    result, longResult = yield self.processQuery(value, x)
+                    query = msg["query"]
+                    result, longResult = yield self.processQuery(
+                            query["value"], query["x"])
                 elif "command" in msg:
-                    command = msg["command"]["command"]
-                    x = msg["command"]["x"]
-                    url = msg["command"]["url"]
-                    number = msg["command"]["number"]
-                    result, longResult = yield self.processCommand(command, x, url, number)
+                    command = msg["command"]
+                    result, longResult = yield self.processCommand(
+                            command["command"], command["x"],
+                            command["url"], command["number"])
                 else:
                     logging.warning("Unknown message: " + str(msg))
 
                 # Send results back
                 if result and longResult:
-                    self.ws.write_message(json.dumps({
+                    write(dumps({
                         "response": result,
                         "longResponse": longResult
                     }))
                 elif result:
-                    self.ws.write_message(json.dumps({
+                    write(dumps({
                         "response": result,
                     }))
         except KeyboardInterrupt:
             pass
 
-    def keep_alive(self):
-        if self.ws is None:
-            logging.info("Reconnecting")
-            self.connect()
-
     @tornado.gen.coroutine
     def processQuery(self, value, x):
-        msg = "Unknown query"
-        longMsg = None
+        result = yield self.processQuery_sync(value, x)
+        return result
 
-        if value == "memory":
-            msg = "Memory usage is "+"%.1f"%psutil.virtual_memory().percent+"%"
-        elif value == "disk":
-            partitions = psutil.disk_partitions()
-            msg = "Disk usage is "
-
-            for p in partitions:
-                d = psutil.disk_usage(p.mountpoint)
-                msg += p.mountpoint + " " + "%.1f"%d.percent + "% "
-        elif value == "battery":
-            msg = "Battery is "+"%.1f"%psutil.sensors_battery().percent+"%"
-        elif value == "processor":
-            msg = "CPU usage is "+"%.1f"%psutil.cpu_percent(interval=0.5)+"%"
-            pass
-        elif value == "open":
-            found = False
-            search = x.strip().lower()
+    @run_on_executor
+    def processQuery_sync(self, value, x):
+        """
+        The psutil calls block, so run the queries on the executor
+        """
+        handler = self.queries.get(value, self.query_unknown)
+        return handler(x)
 
-            for proc in psutil.process_iter(attrs=["name"]):
-                if search in proc.info["name"].lower():
-                    found = True
-                    break
+    def query_unknown(self, x):
+        return "Unknown query", None
 
-            if found:
-                msg = "Yes, "+search+" is running"
-            else:
-                msg = "No, "+search+" is not running"
+    def query_memory(self, x):
+        return f"Memory usage is {psutil.virtual_memory().percent:.1f}%", None
 
-        return msg, longMsg
+    def query_disk(self, x):
+        msg = " ".join(["Disk usage is"] + [
+            f"{p.mountpoint} {psutil.disk_usage(p.mountpoint).percent:.1f}%"
+            for p in self.get_partitions()])
+        return msg, None
+
+    def query_battery(self, x):
+        return f"Battery is {self.get_battery().percent:.1f}%", None
+
+    def query_processor(self, x):
+        return f"CPU usage is {self.cpuPercent:.1f}%", None
+
+    def query_open(self, x):
+        search = x.strip().lower()
+        names = self.get_procNames()
+        found = any(search in name for name in names)
+
+        if found:
+            msg = "Yes, "+search+" is running"
+        else:
+            msg = "No, "+search+" is not running"
+
+        return msg, None
+
+    def sample_cpu(self):
+        """
+        CPU usage since the last sample
+        """
+        self.cpuPercent = psutil.cpu_percent(interval=None)
+
+    def get_partitions(self):
+        """
+        Get the partitions to show disk usage for, only rereading them if
+        something was mounted or unmounted. The kernel signals that with
+        POLLPRI on /proc/self/mounts (its mtime doesn't change).
+        """
+        with self.partitionsLock:
+            if self.partitions is None or self.mountsPoll.poll(0):
+                # Reading the file clears the event
+                self.mounts.seek(0)
+                self.mounts.read()
+
+                # Skip read-only images (e.g. snaps) and other pseudo filesystems
+                skip = ("tmpfs", "devtmpfs", "squashfs", "overlay")
+                self.partitions = [p for p in psutil.disk_partitions(all=False)
+                        if p.fstype and p.fstype not in skip]
+
+            return self.partitions
+
+    def get_battery(self, maxAge=10.0):
+        """
+        Get battery status, only rereading it if the last one is older than
+        maxAge seconds since the percentage changes slowly
+        """
+        now = self.ioloop.time()
+        updated, battery = self.battery
+
+        if battery is None or now - updated > maxAge:
+            battery = psutil.sensors_battery()
+            self.battery = (now, battery)
+
+        return battery
+
+    def get_procNames(self, maxAge=2.0):
+        """
+        Get lowercase names of running processes, only rereading the process
+        list if the last one is older than maxAge seconds
+        """
+        now = self.ioloop.time()
+        updated, names = self.procNames
+
+        if now - updated > maxAge:
+            # With attrs, psutil reads each process inside oneshot() and skips
+            # processes that exit while iterating (needs psutil >= 5.3)
+            names = frozenset(p.info["name"].lower()
+                    for p in psutil.process_iter(attrs=["name"])
+                    if p.info["name"])
+            self.procNames = (now, names)
+
+        return names
 
     @tornado.gen.coroutine
     def processCommand(self, command, x, url, number):
-        msg = "Unknown command"
+        handler = self.commands.get(command, self.command_unknown)
+        result = yield handler(x, url, number)
+        return result
+
+    @tornado.gen.coroutine
+    def command_unknown(self, x, url, number):
+        return "Unknown command", None
+
+    @tornado.gen.coroutine
+    def command_notImplemented(self, x, url, number):
+        return "Not implemented yet", None
+
+    @tornado.gen.coroutine
+    def command_poweroff(self, x, url, number):
+        if self.caps["poweroff"]:
+            self.ioloop.add_timeout(datetime.timedelta(seconds=3), self.cmd_poweroff)
+            return "Powering off", None
+        else:
+            return "Cannot power off", None
+
+    @tornado.gen.coroutine
+    def command_sleep(self, x, url, number):
+        if self.caps["sleep"]:
+            self.ioloop.add_timeout(datetime.timedelta(seconds=3), self.cmd_sleep)
+            return "Sleeping", None
+        else:
+            return "Cannot sleep", None
+
+    @tornado.gen.coroutine
+    def command_reboot(self, x, url, number):
+        if self.caps["reboot"]:
+            self.ioloop.add_timeout(datetime.timedelta(seconds=3), self.cmd_reboot)
+            return "Rebooting", None
+        else:
+            return "Cannot reboot", None
+
+    @tornado.gen.coroutine
+    def command_lock(self, x, url, number):
+        yield self.cmd_lock()
+        return "Locking", None
+
+    @tornado.gen.coroutine
+    def command_unlock(self, x, url, number):
+        yield self.cmd_unlock()
+        return "Unlocking", None
+
+    @tornado.gen.coroutine
+    def command_open(self, x, url, number):
+        msg = None
         longMsg = None
 
-        if command == "power off":
-            if self.can_poweroff():
-                self.ioloop.add_timeout(datetime.timedelta(seconds=3), self.cmd_poweroff)
-                msg = "Powering off"
-            else:
-                msg = "Cannot power off"
-        elif command == "sleep":
-            if self.can_sleep():
-                self.ioloop.add_timeout(datetime.timedelta(seconds=3), self.cmd_sleep)
-                msg = "Sleeping"
-            else:
-                msg = "Cannot sleep"
-        elif command == "reboot":
-            if self.can_reboot():
-                self.ioloop.add_timeout(datetime.timedelta(seconds=3), self.cmd_reboot)
-                msg = "Rebooting"
-            else:
-                msg = "Cannot reboot"
-        elif command == "lock":
-            self.cmd_lock()
-            msg = "Locking"
-        elif command == "unlock":
-            self.cmd_unlock()
-            msg = "Unlocking"
-        elif command == "open":
-            if x:
-                results = yield self.cmd_findApp(x.strip().lower())
-
-                if len(results) > 0:
-                    fn = results[0][7:] # remove file://
-                    name = yield self.getAppName(fn)
-                    if name:
-                        msg = "Opening "+name
-                        longMsg = "Opening "+name+": "+fn
-                    else:
-                        msg = "Opening"
-                        longMsg = "Opening "+fn
-                    self.ioloop.add_callback(lambda: self.cmd_openApp(fn, name))
+        if x:
+            results = yield self.cmd_findApp(x.strip().lower())
+
+            if len(results) > 0:
+                fn = results[0][7:] # remove file://
+                name = yield self.getAppName(fn)
+                if name:
+                    msg = "Opening "+name
+                    longMsg = "Opening "+name+": "+fn
                 else:
-                    msg = "No results found"
+                    msg = "Opening"
+                    longMsg = "Opening "+fn
+                self.ioloop.add_callback(lambda: self.cmd_openApp(fn, name))
             else:
-                msg = "Missing program to start"
-        elif command == "close":
-            msg = "Not implemented yet"
-        elif command == "kill":
-            msg = "Not implemented yet"
-        elif command == "locate":
-            if x:
-                # Search might be slow
-                try:
-                    results = yield tornado.gen.with_timeout(datetime.timedelta(seconds=3.5), self.cmd_locateDB(x))
-                except tornado.gen.TimeoutError:
-                    msg = "Timed out"
-                else:
-                    self.locateResults = {}
+                msg = "No results found"
+        else:
+            msg = "Missing program to start"
+
+        return msg, longMsg
 
-                    if results:
-                        msg = "Found "+str(len(results))+" results"
-                        longMsg = "Results:\n"
+    @tornado.gen.coroutine
+    def command_locate(self, x, url, number):
+        msg = None
+        longMsg = None
 
-                        for i, r in enumerate(results):
-                            self.locateResults[i+1] = url_unescape(r)
-                            longMsg += str(i+1) + ") "+r+"\n"
-                    else:
-                        msg = "No results found"
+        if x:
+            # Search might be slow
+            try:
+                results = yield tornado.gen.with_timeout(datetime.timedelta(seconds=3.5), self.cmd_locateDB(x))
+            except tornado.gen.TimeoutError:
+                msg = "Timed out"
             else:
-                msg = "Missing search query"
-
-        elif command == "fetch":
-            if number:
-                try:
-                    item = int(re.search(r'\d+', number).group())
-                except ValueError:
-                    msg = "Invalid item number: "+number
-                except AttributeError:
-                    msg = "Invalid item number: "+number
+                self.locateResults = {}
+
+                if results:
+                    msg = "Found "+str(len(results))+" results"
+                    lines = ["Results:"]
+
+                    for i, r in enumerate(results):
+                        self.locateResults[i+1] = url_unescape(r)
+                        lines.append(str(i+1) + ") "+r)
+
+                    longMsg = "\n".join(lines) + "\n"
                 else:
-                    if item in self.locateResults:
-                        # Input filename, what we saved from the locate command
-                        inputFile = self.locateResults[item]
-
-                        # Output filename
-                        ext = os.path.splitext(inputFile)[-1]
-                        fn = datetime.datetime.now().strftime(
-                                "LinuxControl-Fetch-%Y-%m-%d-%Hh-%Mm-%Ss")+ext
-                        outputFile = os.path.join(os.environ["HOME"], "Dropbox", fn)
-
-                        msg = "Fetching item "+str(item)
-                        longMsg = "Fetching item "+str(item)+": copying"+ \
-                            inputFile+" to "+outputFile
-                        self.ioloop.add_callback(lambda: self.cmd_fetchFile(
-                            inputFile, outputFile))
-                    else:
-                        msg = "Item not found in last locate results"
+                    msg = "No results found"
+        else:
+            msg = "Missing search query"
+
+        return msg, longMsg
+
+    @tornado.gen.coroutine
+    def command_fetch(self, x, url, number):
+        msg = None
+        longMsg = None
+
+        if number:
+            try:
+                item = int(re.search(r'\d+', number).group())
+            except ValueError:
+                msg = "Invalid item number: "+number
+            except AttributeError:
+                msg = "Invalid item number: "+number
             else:
-                msg = "Please specify which item of your locate command to fetch."
-        elif command == "set volume":
-            if number:
-                try:
-                    volume = int(re.search(r'\d+', number).group())
-                except ValueError:
-                    msg = "Invalid percentage: "+number
-                except AttributeError:
-                    msg = "Invalid percentage: "+number
+                if item in self.locateResults:
+                    # Input filename, what we saved from the locate command
+                    inputFile = self.locateResults[item]
+
+                    # Output filename
+                    ext = os.path.splitext(inputFile)[-1]
+                    fn = time.strftime("LinuxControl-Fetch-%Y-%m-%d-%Hh-%Mm-%Ss")+ext
+                    outputFile = os.path.join(self.dropbox, fn)
+
+                    msg = "Fetching item "+str(item)
+                    longMsg = "Fetching item "+str(item)+": copying"+ \
+                        inputFile+" to "+outputFile
+                    self.ioloop.add_callback(lambda: self.cmd_fetchFile(
+                        inputFile, outputFile))
                 else:
-                    with pulsectl.Pulse('setting-volume') as pulse:
-                        for sink in pulse.sink_list():
-                            pulse.volume_set_all_chans(sink, volume/100.0)
-                    msg = "Volume set"
-                    longMsg = "Volume set to "+str(volume)+"%"
+                    msg = "Item not found in last locate results"
+        else:
+            msg = "Please specify which item of your locate command to fetch."
+
+        return msg, longMsg
+
+    @tornado.gen.coroutine
+    def command_setVolume(self, x, url, number):
+        msg = None
+        longMsg = None
+
+        if number:
+            try:
+                volume = int(re.search(r'\d+', number).group())
+            except ValueError:
+                msg = "Invalid percentage: "+number
+            except AttributeError:
+                msg = "Invalid percentage: "+number
             else:
-                msg = "Please specify volume percentage"
-        elif command == "stop":
-            msg = "Not implemented yet"
-        elif command == "take a picture":
-            filename = os.path.join(os.environ["HOME"], "Dropbox",
-                    datetime.datetime.now().strftime(
-                        "LinuxControl-Picture-%Y-%m-%d-%Hh-%Mm-%Ss.png"))
-            msg = "Taking picture, saving in Dropbox"
-            longMsg = "Taking picture: " + filename
-            self.ioloop.add_callback(lambda: self.cmd_image(filename))
-        elif command == "screenshot":
-            filename = os.path.join(os.environ["HOME"], "Dropbox",
-                    datetime.datetime.now().strftime(
-                        "LinuxControl-Screenshot-%Y-%m-%d-%Hh-%Mm-%Ss.png"))
-            msg = "Taking screenshot, saving in Dropbox"
-            longMsg = "Taking screenshot: " + filename
-            self.ioloop.add_callback(lambda: self.cmd_screenshot(filename))
-        elif command == "download":
-            msg = "Not implemented yet"
-        elif command == "start recording":
-            msg = "Not implemented yet"
-        elif command == "stop recording":
-            msg = "Not implemented yet"
+                yield self.cmd_setVolume(volume/100.0)
+                msg = "Volume set"
+                longMsg = "Volume set to "+str(volume)+"%"
+        else:
+            msg = "Please specify volume percentage"
 
         return msg, longMsg
 
+    @tornado.gen.coroutine
+    def command_picture(self, x, url, number):
+        filename = os.path.join(self.dropbox,
+                time.strftime("LinuxControl-Picture-%Y-%m-%d-%Hh-%Mm-%Ss.png"))
+        self.ioloop.add_callback(lambda: self.cmd_image(filename))
+        return "Taking picture, saving in Dropbox", "Taking picture: " + filename
+
+    @tornado.gen.coroutine
+    def command_screenshot(self, x, url, number):
+        filename = os.path.join(self.dropbox,
+                time.strftime("LinuxControl-Screenshot-%Y-%m-%d-%Hh-%Mm-%Ss.png"))
+        self.ioloop.add_callback(lambda: self.cmd_screenshot(filename))
+        return "Taking screenshot, saving in Dropbox", "Taking screenshot: " + filename
+
     @run_on_executor
     def cmd_screenshot(self, filename):
         """
-        Take Gnome screenshot
+        Take Gnome screenshot, without cursor or flash
         """
-        os.system("gnome-screenshot -f '%s'" % filename)
+        success, filenameUsed = self.dbus_call("Screenshot", False, False, filename)
+
+        if not success:
+            logging.error("Could not take screenshot")
 
     @run_on_executor
     def cmd_fetchFile(self, inputFile, outputFile):
@@ -308,32 +496,46 @@ class WSClient:
         """
         Capture image from webcam with OpenCV
         """
-        cap = cv2.VideoCapture(0)
-        ret, frame = cap.read()
-
-        if frame is not None:
+        with self.capLock:
+            if self.cap is None or not self.cap.isOpened():
+                self.cap = cv2.VideoCapture(0)
+                # Only buffer one frame so we don't get an old picture
+                self.cap.set(cv2.CAP_PROP_BUFFERSIZE, 1)
+
+            # Skip any buffered frames without decoding them, then only decode
+            # the one we want
+            for _ in range(2):
+                self.cap.grab()
+            ret, frame = self.cap.retrieve()
+
+        if ret and frame is not None:
             cv2.imwrite(filename, frame)
 
+    def release_camera(self):
+        """
+        Close the webcam on exit
+        """
+        with self.capLock:
+            if self.cap is not None:
+                self.cap.release()
+                self.cap = None
+
     @run_on_executor
-    def cmd_locate(self, pattern):
+    def cmd_locate(self, pattern, limit=20):
         """
-        This searches the mlocate DB, but that most of the time times out, so
-        instead probably use the cmd_locateDB() function.
+        Search the plocate DB, which unlike the mlocate DB uses an index, so
+        it's fast enough to not time out. Alternatively, use cmd_locateDB()
+        to search the Gnome Tracker DB.
         """
-        mlocatedb="/var/lib/mlocate/mlocate.db"
-        results = ""
+        try:
+            output = subprocess.check_output(['plocate', '--ignore-case',
+                '--limit', str(limit), '--', pattern],
+                universal_newlines=True)
+        except subprocess.CalledProcessError:
+            # plocate exits with 1 if there are no results
+            output = ""
 
-        with open(mlocatedb, 'rb') as db:
-            for p in plocate.locate([pattern], db,
-                    type="file",
-                    ignore_case=True,
-                    limit=2,
-                    existing=False,
-                    match="wholename",
-                    all=False):
-                results += p + " "
-
-        return results
+        return output.splitlines()
 
     @run_on_executor
     def cmd_locateDB(self, query):
@@ -420,61 +622,133 @@ class WSClient:
             for windowId in xdo.search_windows(winname=name.encode("utf-8")):
                 xdo.activate_window(windowId)
 
+    @run_on_executor
+    def cmd_setVolume(self, volume):
+        """
+        Set volume of all PulseAudio sinks, reconnecting if PulseAudio was
+        restarted since the last time
+        """
+        with self.pulseLock:
+            try:
+                self.set_sinkVolumes(volume)
+            except pulsectl.PulseDisconnected:
+                logging.info("Reconnecting to PulseAudio")
+                self.pulse.close()
+                self.pulse = None
+                self.set_sinkVolumes(volume)
+
+    def set_sinkVolumes(self, volume):
+        if self.pulse is None:
+            self.pulse = pulsectl.Pulse('linux-control')
+
+        # Only change hardware sinks, not virtual ones like loopbacks that
+        # follow them anyway, unless there are only virtual sinks
+        sinks = self.pulse.sink_list()
+        hardware = [s for s in sinks if s.flags & PA_SINK_HARDWARE]
+
+        # Same volume for every sink with the same number of channels
+        volumes = {}
+
+        for sink in hardware or sinks:
+            channels = len(sink.volume.values)
+
+            if channels not in volumes:
+                volumes[channels] = pulsectl.PulseVolumeInfo(volume, channels)
+
+            self.pulse.volume_set(sink, volumes[channels])
+
+    def connect_dbus(self):
+        """
+        Look up the logind and Gnome screensaver/screenshot DBus methods once,
+        so each of these commands is only a single DBus call
+        """
+        methods = {}
+        self.add_dbus_methods(methods, dbus.SystemBus,
+                'org.freedesktop.login1', '/org/freedesktop/login1',
+                'org.freedesktop.login1.Manager',
+                ["CanPowerOff", "CanSuspend", "CanReboot",
+                    "PowerOff", "Suspend", "Reboot"])
+        self.add_dbus_methods(methods, dbus.SessionBus,
+                'org.gnome.ScreenSaver', '/org/gnome/ScreenSaver',
+                'org.gnome.ScreenSaver',
+                ["SetActive"])
+        self.add_dbus_methods(methods, dbus.SessionBus,
+                'org.gnome.Shell.Screenshot', '/org/gnome/Shell/Screenshot',
+                'org.gnome.Shell.Screenshot',
+                ["Screenshot"])
+
+        # Replace all at once since commands may be running on other threads
+        self.dbusMethods = methods
+
+    def add_dbus_methods(self, methods, bus, name, path, interface, names):
+        """
+        Save the bound methods of a DBus interface in methods. If the bus
+        isn't available (e.g. no session bus when not in a graphical
+        environment), skip it and try again when one of its methods is needed.
+        """
+        try:
+            obj = bus().get_object(name, path)
+            iface = dbus.Interface(obj, interface)
+        except dbus.exceptions.DBusException:
+            logging.warning("Could not connect to DBus for "+name)
+        else:
+            for m in names:
+                methods[m] = iface.get_dbus_method(m)
+
+    def dbus_call(self, method, *args):
+        """
+        Call one of the saved DBus methods, reconnecting once if it's not
+        available or the call fails, e.g. if the service was restarted
+        """
+        try:
+            return self.dbusMethods[method](*args)
+        except (KeyError, dbus.exceptions.DBusException):
+            logging.info("Reconnecting to DBus")
+            self.connect_dbus()
+            return self.dbusMethods[method](*args)
+
+    def check_caps(self):
+        """
+        Check which of power off, sleep, and reboot are allowed
+        """
+        try:
+            self.caps = {
+                "poweroff": self.can_poweroff(),
+                "sleep": self.can_sleep(),
+                "reboot": self.can_reboot(),
+            }
+        except (KeyError, dbus.exceptions.DBusException):
+            logging.warning("Could not check power capabilities")
+            self.caps = { "poweroff": False, "sleep": False, "reboot": False }
+
     def can_poweroff(self):
-        bus = dbus.SystemBus()
-        obj = bus.get_object('org.freedesktop.login1', '/org/freedesktop/login1')
-        iface = dbus.Interface(obj, 'org.freedesktop.login1.Manager')
-        result = iface.get_dbus_method("CanPowerOff")
-        return result() == "yes"
+        return self.dbus_call("CanPowerOff") == "yes"
 
     def can_sleep(self):
-        bus = dbus.SystemBus()
-        obj = bus.get_object('org.freedesktop.login1', '/org/freedesktop/login1')
-        iface = dbus.Interface(obj, 'org.freedesktop.login1.Manager')
-        result = iface.get_dbus_method("CanSuspend")
-        return result() == "yes"
+        return self.dbus_call("CanSuspend") == "yes"
 
     def can_reboot(self):
-        bus = dbus.SystemBus()
-        obj = bus.get_object('org.freedesktop.login1', '/org/freedesktop/login1')
-        iface = dbus.Interface(obj, 'org.freedesktop.login1.Manager')
-        result = iface.get_dbus_method("CanReboot")
-        return result() == "yes"
+        return self.dbus_call("CanReboot") == "yes"
 
+    @run_on_executor
     def cmd_poweroff(self):
-        bus = dbus.SystemBus()
-        obj = bus.get_object('org.freedesktop.login1', '/org/freedesktop/login1')
-        iface = dbus.Interface(obj, 'org.freedesktop.login1.Manager')
-        method = iface.get_dbus_method("PowerOff")
-        method(True)
+        self.dbus_call("PowerOff", True)
 
+    @run_on_executor
     def cmd_sleep(self):
-        bus = dbus.SystemBus()
-        obj = bus.get_object('org.freedesktop.login1', '/org/freedesktop/login1')
-        iface = dbus.Interface(obj, 'org.freedesktop.login1.Manager')
-        method = iface.get_dbus_method("Suspend")
-        method(True)
+        self.dbus_call("Suspend", True)
 
+    @run_on_executor
     def cmd_reboot(self):
-        bus = dbus.SystemBus()
-        obj = bus.get_object('org.freedesktop.login1', '/org/freedesktop/login1')
-        iface = dbus.Interface(obj, 'org.freedesktop.login1.Manager')
-        method = iface.get_dbus_method("Reboot")
-        method(True)
+        self.dbus_call("Reboot", True)
 
+    @run_on_executor
     def cmd_lock(self):
-        bus = dbus.SessionBus()
-        obj = bus.get_object('org.gnome.ScreenSaver', '/org/gnome/ScreenSaver')
-        iface = dbus.Interface(obj, 'org.gnome.ScreenSaver')
-        method = iface.get_dbus_method("SetActive")
-        method(True)
+        self.dbus_call("SetActive", True)
 
+    @run_on_executor
     def cmd_unlock(self):
-        bus = dbus.SessionBus()
-        obj = bus.get_object('org.gnome.ScreenSaver', '/org/gnome/ScreenSaver')
-        iface = dbus.Interface(obj, 'org.gnome.ScreenSaver')
-        method = iface.get_dbus_method("SetActive")
-        method(False)
+        self.dbus_call("SetActive", False)
 
 if __name__ == "__main__":
     # Parse config
@@ -500,5 +774,14 @@ if __name__ == "__main__":
     # For now, show info
     logging.getLogger().setLevel(logging.INFO)
 
+    # Use the faster libuv event loop if it's installed
+    try:
+        import uvloop
+    except ImportError:
+        logging.info("uvloop not found, using default event loop")
+    else:
+        asyncio.set_event_loop_policy(uvloop.EventLoopPolicy())
+        tornado.ioloop.IOLoop.configure('tornado.platform.asyncio.AsyncIOLoop')
+
     # Run the client
     client = WSClient(url)